@@ -1,7 +1,14 @@
-from finance_UI import app, db
+from threading import Thread
+
+from finance_UI import app, db, shard_router, job_queue
+from sharding import create_shard_tables
 
 if __name__ == '__main__':
     with app.app_context():
         db.create_all()
+        create_shard_tables(db, shard_router)
+
+    # Run background jobs in-process for local development; deployments run worker.py instead
+    Thread(target=job_queue.work, daemon=True).start()
 
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,97 @@
+"""Per-year partition tables for archived rows.
+
+Rows older than the archive cutoff are moved out of a hot table (for example
+``transaction``) into ``<table>_archive_<year>`` tables that share its columns.
+The hot table and its indexes then only hold recent data. Partition tables are
+created on demand in whichever database the connection points at, so each
+shard keeps its own archive. Partitions have their own ``archive_id`` key and
+keep the source ``id`` as a plain column, because the hot table may hand an
+archived row's id out again.
+"""
+from collections import defaultdict
+
+import sqlalchemy as sa
+
+
+# Kept apart from db.metadata so create_all/migrations never touch partitions
+_partition_metadata = sa.MetaData()
+
+
+def partition_name(table, year):
+    return f'{table.name}_archive_{year}'
+
+
+def partition_table(table, year):
+    name = partition_name(table, year)
+    if name in _partition_metadata.tables:
+        return _partition_metadata.tables[name]
+
+    columns = [
+        sa.Column(column.name, column.type, nullable=column.nullable)
+        for column in table.columns
+    ]
+    return sa.Table(name, _partition_metadata,
+                    sa.Column('archive_id', sa.Integer, primary_key=True), *columns,
+                    sa.Index(f'ix_{name}_user_id_date', 'user_id', 'date'),
+                    sqlite_autoincrement=True)
+
+
+def archived_years(connection, table):
+    prefix = f'{table.name}_archive_'
+    years = []
+    for name in sa.inspect(connection).get_table_names():
+        if name.startswith(prefix) and name[len(prefix):].isdigit():
+            years.append(int(name[len(prefix):]))
+    return sorted(years)
+
+
+def archive_rows(connection, table, cutoff, batch_size=500):
+    """Move every row dated before ``cutoff`` into its year's partition.
+
+    Runs on the caller's connection so the copy and the delete commit together.
+    Only the rows that were copied are deleted, so a back-dated row added after
+    the select stays in the hot table until the next run. Returns the moved
+    rows so the caller can update its summaries.
+    """
+    rows = connection.execute(sa.select(table).where(table.c.date < cutoff)).mappings().all()
+    if not rows:
+        return []
+
+    rows_by_year = defaultdict(list)
+    for row in rows:
+        rows_by_year[row['date'].year].append(dict(row))
+
+    for year, year_rows in rows_by_year.items():
+        partition = partition_table(table, year)
+        partition.create(connection, checkfirst=True)
+        connection.execute(sa.insert(partition), year_rows)
+
+    ids = [row['id'] for row in rows]
+    for start in range(0, len(ids), batch_size):
+        connection.execute(sa.delete(table).where(table.c.id.in_(ids[start:start + batch_size])))
+    return rows
+
+
+def read_archived_rows(connection, table, user_id, start=None, end=None):
+    """Return a user's archived rows, optionally limited to ``start <= date <= end``."""
+    rows = []
+    for year in archived_years(connection, table):
+        if (start is not None and year < start.year) or (end is not None and year > end.year):
+            continue
+
+        partition = partition_table(table, year)
+        query = sa.select(partition).where(partition.c.user_id == user_id)
+        if start is not None:
+            query = query.where(partition.c.date >= start)
+        if end is not None:
+            query = query.where(partition.c.date <= end)
+        rows.extend(connection.execute(query).mappings().all())
+    return rows
+
+
+def delete_archived_rows(connection, table, user_id):
+    deleted = 0
+    for year in archived_years(connection, table):
+        partition = partition_table(table, year)
+        deleted += connection.execute(sa.delete(partition).where(partition.c.user_id == user_id)).rowcount
+    return deleted
@@ -0,0 +1,67 @@
+"""Build fingerprinted, minified and precompressed copies of the stylesheets.
+
+    python build_assets.py
+
+Writes ``static/dist/<name>.<hash>.css`` (plus ``.gz`` and, when brotli is
+installed, ``.br`` siblings) and ``static/dist/manifest.json`` mapping each
+original file name to its fingerprinted copy. finance_UI serves these from
+``/assets/`` with immutable cache headers. Each page keeps its own stylesheet
+rather than one shared bundle, because the files restyle the same selectors
+(``body``, ``button``, ``.container``) differently per page.
+"""
+import hashlib
+import json
+import os
+import re
+import shutil
+
+from compression import ENCODING_SUFFIXES, compress_for_storage, supported_encodings
+
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+DIST_DIR = os.path.join(STATIC_DIR, 'dist')
+MANIFEST_NAME = 'manifest.json'
+
+
+def minify_css(css):
+    css = re.sub(r'/\*.*?\*/', '', css, flags=re.S)
+    css = re.sub(r'\s+', ' ', css)
+    css = re.sub(r'\s*([{};,>])\s*', r'\1', css)
+    css = re.sub(r':\s+', ':', css)
+    css = css.replace(';}', '}')
+    return css.strip()
+
+
+def build():
+    shutil.rmtree(DIST_DIR, ignore_errors=True)
+    os.makedirs(DIST_DIR)
+
+    manifest = {}
+    for name in sorted(os.listdir(STATIC_DIR)):
+        if not name.endswith('.css'):
+            continue
+
+        with open(os.path.join(STATIC_DIR, name), encoding='utf-8') as source:
+            data = minify_css(source.read()).encode('utf-8')
+
+        digest = hashlib.sha256(data).hexdigest()[:12]
+        base, extension = os.path.splitext(name)
+        built_name = f'{base}.{digest}{extension}'
+
+        with open(os.path.join(DIST_DIR, built_name), 'wb') as output:
+            output.write(data)
+        for encoding in supported_encodings():
+            with open(os.path.join(DIST_DIR, built_name + ENCODING_SUFFIXES[encoding]), 'wb') as output:
+                output.write(compress_for_storage(data, encoding))
+
+        manifest[name] = built_name
+
+    with open(os.path.join(DIST_DIR, MANIFEST_NAME), 'w') as output:
+        json.dump(manifest, output, indent=2, sort_keys=True)
+
+    return manifest
+
+
+if __name__ == '__main__':
+    for name, built_name in build().items():
+        print(f'{name} -> dist/{built_name}')
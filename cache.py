@@ -0,0 +1,138 @@
+"""Pluggable cache backends and per-user versioned caching.
+
+Cached values are keyed by the user's data version. Mutating routes call
+``bump_version(user_id)``, which makes every older entry for that user
+unreachable, so nothing has to be deleted by hand. Versions live in the cache
+backend unless a separate version store is given; pass one that every process
+can see (the app keeps them in a per-user row on the user's shard) when writes
+also happen outside the web workers, e.g. in background jobs. The in-process
+LRU is the default backend; point ``FINANCE_CACHE_URL`` at a Redis-compatible
+server to share the cached values between workers too.
+"""
+import json
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Thread-safe in-process cache that drops the least recently used keys."""
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._data:
+                return None
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def incr(self, key):
+        with self._lock:
+            value = int(self._data.get(key) or 0) + 1
+            self._data[key] = value
+            self._data.move_to_end(key)
+            return value
+
+
+class RedisCache:
+    """Cache backed by any Redis-compatible server; values are stored as JSON."""
+
+    def __init__(self, url, ttl=24 * 60 * 60):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError('The redis package is required when FINANCE_CACHE_URL is set.') from e
+
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+
+    def get(self, key):
+        value = self.client.get(key)
+        if value is None:
+            return None
+        return json.loads(value)
+
+    def set(self, key, value):
+        self.client.set(key, json.dumps(value), ex=self.ttl)
+
+    def delete(self, key):
+        self.client.delete(key)
+
+    def incr(self, key):
+        return self.client.incr(key)
+
+
+def make_cache(app):
+    url = app.config.get('FINANCE_CACHE_URL')
+    if url:
+        return RedisCache(url)
+    return LRUCache(app.config.get('FINANCE_CACHE_MAX_ENTRIES', 1024))
+
+
+class BackendVersionStore:
+    """Keeps the per-user version counters in the cache backend itself."""
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    @staticmethod
+    def _version_key(user_id):
+        return f'user:{user_id}:version'
+
+    def get(self, user_id):
+        return int(self.backend.get(self._version_key(user_id)) or 0)
+
+    def bump(self, user_ids):
+        for user_id in user_ids:
+            self.backend.incr(self._version_key(user_id))
+
+
+class UserDataCache:
+    def __init__(self, backend, versions=None):
+        self.backend = backend
+        # Anything with get(user_id) and bump(user_ids)
+        self.versions = versions or BackendVersionStore(backend)
+
+    def version(self, user_id):
+        return self.versions.get(user_id)
+
+    def bump_version(self, user_id):
+        self.bump_versions([user_id])
+
+    def bump_versions(self, user_ids):
+        user_ids = list(user_ids)
+        if user_ids:
+            self.versions.bump(user_ids)
+
+    def key(self, namespace, user_id):
+        # Resolve the key up front so a value built during a concurrent write lands under the old version
+        return f'{namespace}:{user_id}:{self.version(user_id)}'
+
+    def get(self, key):
+        return self.backend.get(key)
+
+    def set(self, key, value):
+        # Values must be JSON-friendly so they work with every backend
+        self.backend.set(key, value)
+
+    def get_or_build(self, namespace, user_id, build):
+        key = self.key(namespace, user_id)
+        value = self.get(key)
+        if value is None:
+            value = build()
+            self.set(key, value)
+        return value
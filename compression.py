@@ -0,0 +1,47 @@
+"""gzip/brotli helpers for responses and prebuilt static assets."""
+import gzip
+import zlib
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+
+# File suffix of the precompressed copy written for each encoding
+ENCODING_SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+
+
+def supported_encodings():
+    return ['br', 'gzip'] if brotli is not None else ['gzip']
+
+
+def negotiate(accept_encodings, available=None):
+    """Pick the best encoding the client accepts, or ``None`` for identity."""
+    offered = [encoding for encoding in supported_encodings() if available is None or encoding in available]
+    return accept_encodings.best_match(offered) if offered else None
+
+
+def compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=5)
+    return gzip.compress(data, compresslevel=6)
+
+
+def compress_for_storage(data, encoding):
+    # Built once at deploy time, so spend the extra CPU on the smallest output
+    if encoding == 'br':
+        return brotli.compress(data, quality=11)
+    return gzip.compress(data, compresslevel=9)
+
+
+def gzip_stream(chunks, charset='utf-8'):
+    """gzip a streamed body, flushing after every chunk so the client isn't kept waiting."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode(charset)
+        data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
@@ -1,32 +1,90 @@
-from flask import render_template, request, flash, redirect, url_for
+from flask import render_template, request, flash, redirect, url_for, jsonify, stream_template, send_from_directory
+from flask import has_request_context
 from flask_login import login_user, current_user, login_required, logout_user
 import pandas as pd
 from datetime import datetime, timedelta
-from flask import current_app
 from flask import Flask
+from jinja2 import FileSystemBytecodeCache
+from markupsafe import Markup
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, UserMixin
 from flask_bcrypt import Bcrypt
 from flask_migrate import Migrate
+from werkzeug.middleware.proxy_fix import ProxyFix
 from sqlalchemy import func, and_
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 import schedule
 import time
 from threading import Thread
 import calendar
 import matplotlib.pyplot as plt
 from io import BytesIO
+import os
 import base64
 import matplotlib
 matplotlib.use('Agg')
 import re
+import click
+import json
+import mimetypes
+from sharding import ShardedSession, configure_shards, create_shard_tables, fan_out, rebalance, shard_scope
+from cache import UserDataCache, make_cache
+from archive import archive_rows, read_archived_rows, delete_archived_rows
+from ratelimit import RateLimiter, make_bucket_store
+from projection import project_charges
+from compression import ENCODING_SUFFIXES, compress, gzip_stream, negotiate
+from jobqueue import JobQueue
 
 
 
-app = Flask(__name__)
+# FINANCE_INSTANCE_PATH (absolute) moves the databases somewhere else, e.g. for load tests
+app = Flask(__name__, instance_path=os.environ.get('FINANCE_INSTANCE_PATH'))
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///finance.db'
 app.secret_key = 'personal_finance_tracker'
-
-db = SQLAlchemy(app)
+app.config['FINANCE_CACHE_URL'] = os.environ.get('FINANCE_CACHE_URL')
+app.config['DASHBOARD_RECENT_TRANSACTIONS'] = 50
+# Transaction lists at least this long are streamed instead of rendered in one piece
+app.config['STREAM_TEMPLATE_THRESHOLD'] = 500
+# Rendered transaction lists larger than this are not cached
+app.config['FRAGMENT_CACHE_MAX_BYTES'] = 512 * 1024
+# HTML/JSON/CSS responses at least this many bytes are gzip/brotli compressed
+app.config['COMPRESS_MIN_SIZE'] = 1024
+app.config['COMPRESS_MIMETYPES'] = {'text/html', 'application/json', 'text/css'}
+# Imports with at least this many rows are handed to the background worker
+app.config['BACKGROUND_IMPORT_THRESHOLD'] = 100
+# A job still waiting for its first run this many seconds after it was due means no worker is running
+app.config['JOB_STALLED_SECONDS'] = 10
+# How many months of upcoming subscription charges budget_info lists
+app.config['PROJECTION_MONTHS'] = 3
+# Transactions older than this many whole months are moved to per-year archive tables
+app.config['ARCHIVE_HORIZON_MONTHS'] = int(os.environ.get('ARCHIVE_HORIZON_MONTHS', 12))
+# Login attempts allowed per (count, seconds), e.g. LOGIN_RATE_LIMIT_PER_IP=20/60;
+# set FINANCE_RATE_LIMIT_URL to share the buckets between workers
+app.config['FINANCE_RATE_LIMIT_URL'] = os.environ.get('FINANCE_RATE_LIMIT_URL')
+app.config['LOGIN_RATE_LIMIT_PER_IP'] = tuple(map(int, os.environ.get('LOGIN_RATE_LIMIT_PER_IP', '20/60').split('/')))
+app.config['LOGIN_RATE_LIMIT_PER_USERNAME'] = tuple(map(int, os.environ.get('LOGIN_RATE_LIMIT_PER_USERNAME', '5/60').split('/')))
+# Number of trusted reverse proxies in front of the app. The per-IP login limit keys on the client
+# address, so without this every client behind a proxy shares the proxy's address and one bucket.
+app.config['FINANCE_PROXY_HOPS'] = int(os.environ.get('FINANCE_PROXY_HOPS', 0))
+if app.config['FINANCE_PROXY_HOPS']:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['FINANCE_PROXY_HOPS'])
+
+# Keep compiled templates on disk so new workers skip recompiling them
+os.makedirs(os.path.join(app.instance_path, 'jinja_cache'), exist_ok=True)
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache(os.path.join(app.instance_path, 'jinja_cache'))
+
+# Fingerprinted stylesheets written by build_assets.py; without a build the plain static files are used
+ASSET_DIR = os.path.join(app.static_folder, 'dist')
+try:
+    with open(os.path.join(ASSET_DIR, 'manifest.json')) as manifest_file:
+        asset_manifest = json.load(manifest_file)
+except FileNotFoundError:
+    asset_manifest = {}
+
+# Number of SQLite shards for per-user tables; 0 keeps everything in finance.db
+shard_router = configure_shards(app, os.environ.get('FINANCE_SHARD_COUNT', 0))
+
+db = SQLAlchemy(app, session_options={'class_': ShardedSession})
 
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
@@ -34,6 +92,25 @@ login_manager.login_view = 'login'
 bcrypt = Bcrypt(app)
 migrate = Migrate(app, db)
 
+app.config['FINANCE_JOB_DB'] = os.environ.get('FINANCE_JOB_DB', os.path.join(app.instance_path, 'jobs.db'))
+# Finished and failed jobs are deleted after this many hours
+app.config['FINANCE_JOB_RETENTION_HOURS'] = float(os.environ.get('FINANCE_JOB_RETENTION_HOURS', 24))
+
+
+def run_job(handler, job):
+    # Jobs run outside any request, so give each one an app context on its user's shard
+    with app.app_context(), shard_router.use_user(job['user_id']):
+        return handler(job['user_id'], **job['payload'])
+
+
+# Expensive per-user work is queued here and run by worker.py
+job_queue = JobQueue(app.config['FINANCE_JOB_DB'], runner=run_job,
+                     retention_seconds=app.config['FINANCE_JOB_RETENTION_HOURS'] * 60 * 60)
+
+rate_limit_store = make_bucket_store(app.config['FINANCE_RATE_LIMIT_URL'])
+login_ip_limiter = RateLimiter(rate_limit_store, *app.config['LOGIN_RATE_LIMIT_PER_IP'])
+login_username_limiter = RateLimiter(rate_limit_store, *app.config['LOGIN_RATE_LIMIT_PER_USERNAME'])
+
 
 class User(db.Model, UserMixin):
     id = db.Column(db.Integer, primary_key=True)
@@ -44,6 +121,9 @@ class User(db.Model, UserMixin):
 
     budget = db.Column(db.Float, default=0.0, nullable=False)
 
+    # Cache version of the user's data, read from their shard at most once per request
+    data_version = None
+
     def set_password(self, password):
         self.password = bcrypt.generate_password_hash(password).decode('utf-8')
 
@@ -54,14 +134,84 @@ class User(db.Model, UserMixin):
         return str(self.id)
 
 
+# Bumped on every write to the user's data; cached pages are keyed by it. Kept on the user's
+# shard so a bump only locks the database that was just written anyway.
+class UserDataVersion(db.Model):
+    __sharded__ = True
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, unique=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+
+class UserDataVersions:
+    """Cache versions stored in UserDataVersion rows, so worker.py's writes invalidate every web worker's cache."""
+
+    @staticmethod
+    def _is_current_user(user_id):
+        return has_request_context() and current_user.is_authenticated and current_user.id == user_id
+
+    def load(self, user_id):
+        with shard_router.use_user(user_id):
+            return db.session.query(UserDataVersion.version).filter_by(user_id=user_id).scalar() or 0
+
+    def get(self, user_id):
+        if not self._is_current_user(user_id):
+            return self.load(user_id)
+        if current_user.data_version is None:
+            current_user.data_version = self.load(user_id)
+        return current_user.data_version
+
+    def bump(self, user_ids):
+        rows_by_shard = {}
+        for user_id in user_ids:
+            rows_by_shard.setdefault(shard_router.shard_for(user_id), []).append({'user_id': user_id, 'version': 1})
+
+        table = UserDataVersion.__table__
+        upsert = sqlite_insert(table).on_conflict_do_update(
+            index_elements=[table.c.user_id], set_={'version': table.c.version + 1}
+        )
+        for bind_key, rows in rows_by_shard.items():
+            with shard_scope(bind_key):
+                db.session.execute(upsert, rows, bind_arguments={'mapper': UserDataVersion})
+        db.session.commit()
+
+        if has_request_context() and current_user.is_authenticated and current_user.id in user_ids:
+            # Read it again on next use, since another process may have bumped it as well
+            current_user.data_version = None
+
+
+# Per-user view models, invalidated by bumping the user's data version on every write
+user_cache = UserDataCache(make_cache(app), versions=UserDataVersions())
+
+
 class Transaction(db.Model):
+    __sharded__ = True
+    __table_args__ = (db.Index('ix_transaction_user_id_date', 'user_id', 'date'),)
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)  # Add ForeignKey constraint
     category = db.Column(db.String(50), nullable=False)
     amount = db.Column(db.Float, nullable=False)
     date = db.Column(db.Date, nullable=False)
 
+
+# Monthly spending per category for transactions that have been archived
+class TransactionSummary(db.Model):
+    __sharded__ = True
+    __table_args__ = (db.UniqueConstraint('user_id', 'year', 'month', 'category'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    year = db.Column(db.Integer, nullable=False)
+    month = db.Column(db.Integer, nullable=False)
+    category = db.Column(db.String(50), nullable=False)
+    total = db.Column(db.Float, nullable=False, default=0.0)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
 class Budget(db.Model):
+    __sharded__ = True
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     month = db.Column(db.Integer, nullable=False)
@@ -71,6 +221,8 @@ class Budget(db.Model):
 
 
 class Subscription(db.Model):
+    __sharded__ = True
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     name = db.Column(db.String(50), nullable=False)
@@ -101,6 +253,104 @@ def calculate_remaining_budget(user_id):
 
     return remaining_budget
 
+def build_dashboard_snapshot(user_id):
+    now = datetime.now()
+    first_date, last_date = get_first_and_last_date_of_month(now.year, now.month)
+
+    recent_transactions = Transaction.query.filter_by(user_id=user_id).order_by(
+        Transaction.date.desc(), Transaction.id.desc()
+    ).limit(app.config['DASHBOARD_RECENT_TRANSACTIONS']).all()
+
+    category_totals = db.session.query(Transaction.category, func.sum(Transaction.amount)).filter(
+        Transaction.user_id == user_id,
+        Transaction.date >= first_date,
+        Transaction.date <= last_date
+    ).group_by(Transaction.category).all()
+
+    remaining_budget = calculate_remaining_budget(user_id)
+    upcoming_charges = sum(charge['amount'] for charge in get_subscription_projection(user_id))
+
+    return {
+        'remaining_budget': remaining_budget,
+        'projected_remaining_budget': remaining_budget - upcoming_charges,
+        'transactions': [
+            {'category': t.category, 'amount': t.amount, 'date': t.date.isoformat()}
+            for t in recent_transactions
+        ],
+        'category_totals': {category: total for category, total in category_totals},
+    }
+
+
+def build_subscription_projection(user_id, months):
+    # One query for all active subscriptions, expanded into future charges in one go
+    subscriptions = db.session.query(
+        Subscription.name, Subscription.billing_amount, Subscription.billing_date
+    ).filter_by(user_id=user_id, is_active=True).all()
+
+    names = [subscription.name for subscription in subscriptions]
+    amounts = [subscription.billing_amount for subscription in subscriptions]
+    billing_days = [subscription.billing_date for subscription in subscriptions]
+
+    return project_charges(names, amounts, billing_days, datetime.now().date(), months)
+
+
+def get_subscription_projection(user_id, months=1):
+    # Upcoming charges from today through the end of the months-th month, cached until the user's data changes
+    today = datetime.now().date()
+    return user_cache.get_or_build(f'projection:{today.isoformat()}:{months}', user_id,
+                                   lambda: build_subscription_projection(user_id, months))
+
+
+def get_dashboard_snapshot(user_id):
+    # Keyed by day too, since upcoming charges and the current month move with the date
+    today = datetime.now().date()
+    return user_cache.get_or_build(f'dashboard:{today.isoformat()}', user_id, lambda: build_dashboard_snapshot(user_id))
+
+
+def login_attempt_allowed(username):
+    # Checked before any user lookup or bcrypt work so bursts stay cheap. The username
+    # bucket is only charged once the IP passes, so a flood from one address can't
+    # lock the real owner out of their account.
+    return (login_ip_limiter.hit(f'login:ip:{request.remote_addr}')
+            and login_username_limiter.hit(f'login:user:{username}'))
+
+
+def transaction_rows_fragment(name, template, load_transactions):
+    # Rendered rows for a per-user transaction list. There is one entry per user and list, tagged with
+    # the data version it was rendered at, so each rebuild replaces the last one instead of leaving it
+    # behind in the cache. Returns the rows as chunks plus whether the page is long enough to stream.
+    key = f'fragment:{name}:{current_user.id}'
+    version = user_cache.version(current_user.id)
+    cached = user_cache.get(key)
+    if cached is not None and cached['version'] == version:
+        return [Markup(cached['html'])], False
+
+    transactions = load_transactions()
+    max_bytes = app.config['FRAGMENT_CACHE_MAX_BYTES']
+
+    def render_and_cache():
+        chunks = []
+        size = 0
+        for chunk in stream_template(template, transactions=transactions):
+            if chunks is not None:
+                chunks.append(chunk)
+                size += len(chunk)
+                if size > max_bytes:
+                    # Too big to keep in every worker's memory; render it fresh each time
+                    chunks = None
+            yield Markup(chunk)
+        if chunks is not None:
+            user_cache.set(key, {'version': version, 'html': ''.join(chunks)})
+
+    return render_and_cache(), len(transactions) >= app.config['STREAM_TEMPLATE_THRESHOLD']
+
+
+def render_transaction_page(template, rows, stream, **context):
+    if stream:
+        return app.response_class(stream_template(template, transaction_rows=rows, **context))
+    return render_template(template, transaction_rows=rows, **context)
+
+
 def check_password_strength(password):
     
     if re.match(r'^(?=.*[a-z])(?=.*[A-Z])(?=.*\d).{8,}$', password):
@@ -150,6 +400,10 @@ def login():
         username = request.form['username']
         password = request.form['password']
 
+        if not login_attempt_allowed(username):
+            flash('Too many login attempts. Please wait a minute and try again.', 'error')
+            return render_template('login.html'), 429
+
         user = User.query.filter_by(username=username).first()
 
         if user:
@@ -167,19 +421,21 @@ def login():
 @app.route('/dashboard', methods=['GET', 'POST'])
 @login_required
 def dashboard():
+    clear_job_id = None
+
     if request.method == 'POST':
         # Handle any POST requests related to the dashboard here
         if request.form.get('clear_history'):
-            # Handle clearing transaction history
-            current_user.transactions.clear()
-            db.session.commit()
-
-    # Retrieve the user's transactions and create a sorted list based on the date
-    transactions = sorted(current_user.transactions, key=lambda x: x.date, reverse=True)
+            # Clearing can touch every archive table, so leave it to the worker
+            clear_job_id = job_queue.enqueue('clear_history', user_id=current_user.id)
 
-    remaining_budget = calculate_remaining_budget(current_user.id)
+    # Remaining budget, most recent transactions and this month's category totals
+    snapshot = get_dashboard_snapshot(current_user.id)
 
-    return render_template('dashboard.html', transactions=transactions, remaining_budget=remaining_budget)
+    return render_template('dashboard.html', transactions=snapshot['transactions'],
+                           remaining_budget=snapshot['remaining_budget'],
+                           projected_remaining_budget=snapshot['projected_remaining_budget'],
+                           category_totals=snapshot['category_totals'], clear_job_id=clear_job_id)
 
 
 @app.route('/profile', methods=['GET', 'POST'])
@@ -192,6 +448,7 @@ def profile():
         current_user.username = new_username
         
         db.session.commit()
+        user_cache.bump_version(current_user.id)
 
         flash('Profile updated successfully!', 'success')
 
@@ -285,17 +542,49 @@ def get_first_and_last_date_of_month(year, month):
     last_date = datetime(year, month, last_day).date()
     return first_date, last_date
 
-def calculate_remaining_and_total_budget_for_month(user_id, target_month, target_year):
-    # Retrieve the user's transactions for the target month and year
+def transaction_connection():
+    # Connection to the database (shard) holding the current user's transactions
+    return db.session.connection(bind_arguments={'mapper': Transaction})
+
+
+def calculate_monthly_spending(user_id, target_month, target_year):
+    # Archived months are read from the summary table, anything still hot from the transactions
     first_date, last_date = get_first_and_last_date_of_month(target_year, target_month)
-    transactions = Transaction.query.filter(
+    hot_spending = db.session.query(func.sum(Transaction.amount)).filter(
         Transaction.user_id == user_id,
         Transaction.date >= first_date,
         Transaction.date <= last_date
-    ).all()
+    ).scalar()
+    archived_spending = db.session.query(func.sum(TransactionSummary.total)).filter_by(
+        user_id=user_id, year=target_year, month=target_month
+    ).scalar()
+
+    return (hot_spending or 0.0) + (archived_spending or 0.0)
+
+
+def get_all_transactions(user_id, start=None, end=None):
+    # Unified read over the hot table and the yearly archives, newest first
+    query = Transaction.query.filter(Transaction.user_id == user_id)
+    if start is not None:
+        query = query.filter(Transaction.date >= start)
+    if end is not None:
+        query = query.filter(Transaction.date <= end)
 
+    transactions = [
+        {'id': t.id, 'category': t.category, 'amount': t.amount, 'date': t.date, 'archived': False}
+        for t in query.all()
+    ]
+    transactions.extend(
+        {'id': row['id'], 'category': row['category'], 'amount': row['amount'], 'date': row['date'], 'archived': True}
+        for row in read_archived_rows(transaction_connection(), Transaction.__table__, user_id, start, end)
+    )
+
+    return sorted(transactions, key=lambda t: (t['date'], t['id']), reverse=True)
+
+
+def calculate_remaining_and_total_budget_for_month(user_id, target_month, target_year):
     # Calculate total spending for the target month
-    total_spending = sum(transaction.amount for transaction in transactions)
+    total_spending = calculate_monthly_spending(user_id, target_month, target_year)
 
     # Retrieve the user's budget
     user_budget = User.query.get(user_id).budget
@@ -315,14 +604,35 @@ def budget_info():
     current_year = now.year
     remaining_budget, total_budget = calculate_remaining_and_total_budget_for_month(current_user.id, current_month, current_year)
 
-    transactions = Transaction.query.filter(
-        Transaction.user_id == current_user.id,
-        func.extract('month', Transaction.date) == current_month,
-        func.extract('year', Transaction.date) == current_year
-    ).all()
+    # Subscription charges still to come this month and over the next few months
+    upcoming_charges = get_subscription_projection(current_user.id, app.config['PROJECTION_MONTHS'])
+    this_month = now.strftime('%Y-%m')
+    projected_remaining_budget = remaining_budget - sum(
+        charge['amount'] for charge in upcoming_charges if charge['date'].startswith(this_month)
+    )
+
+    previous_months_budgets = calculate_previous_months_budgets(current_user.id, current_month, current_year)
+
+    # The charts are drawn by the background worker; show them once its job is done
+    charts_job = job_queue.get(job_queue.enqueue(
+        'budget_charts', user_id=current_user.id,
+        dedupe_key=f'budget_charts:{current_user.id}:{user_cache.version(current_user.id)}:{now.date().isoformat()}',
+        month=current_month, year=current_year
+    ))
+    if job_stalled(charts_job):
+        # Nothing is running the queue, so draw the charts here instead of leaving the page waiting
+        job_queue.complete(charts_job['id'], budget_charts_job(current_user.id, current_month, current_year))
+        charts_job = job_queue.get(charts_job['id'])
+    charts = charts_job['result'] if charts_job['status'] == 'done' else {}
+
+    # Render a template to display budget information and the plot
+    return render_template('budget_info.html', remaining_budget=remaining_budget, total_budget=total_budget,
+                           projected_remaining_budget=projected_remaining_budget, upcoming_charges=upcoming_charges,
+                           previous_months_budgets=previous_months_budgets, plot_data=charts.get('plot_data'),
+                           plot_data_by_category=charts.get('plot_data_by_category'), charts_job=charts_job)
 
-    plot_data_by_category = plot_spending_by_category(transactions)
 
+def calculate_previous_months_budgets(user_id, current_month, current_year):
     # Calculate remaining and total budget for previous months
     previous_months_budgets = {}
 
@@ -331,22 +641,26 @@ def budget_info():
 
     # Retrieve the budget entry for the current month
     budget_entry = Budget.query.filter(and_(
-    Budget.user_id == current_user.id,
+    Budget.user_id == user_id,
     Budget.month == current_month,
     Budget.year == current_year
 )).first()
 
     if budget_entry:
         # Budget entry exists for the current month
-        remaining, total = calculate_remaining_and_total_budget_for_month(current_user.id, month, current_year)
+        remaining, total = calculate_remaining_and_total_budget_for_month(user_id, month, current_year)
         if total != remaining:
             previous_months_budgets[month_name] = {'remaining': remaining, 'total': budget_entry.amount, 'year': current_year}
     else:
         # Budget entry does not exist, use the previous logic
-        remaining, total = calculate_remaining_and_total_budget_for_month(current_user.id, month, current_year)
+        remaining, total = calculate_remaining_and_total_budget_for_month(user_id, month, current_year)
         if total != remaining:
             previous_months_budgets[month_name] = {'remaining': remaining, 'total': total, 'year': current_year}
 
+    return previous_months_budgets
+
+
+def plot_remaining_budget_over_months(previous_months_budgets):
     # Generate a plot of remaining budget over the previous months
     months = list(previous_months_budgets.keys())
     remaining_budgets = [data['remaining'] for data in previous_months_budgets.values()]
@@ -369,10 +683,62 @@ def budget_info():
     # Close the plot to release resources
     plt.close()
 
-    # Render a template to display budget information and the plot
-    return render_template('budget_info.html', remaining_budget=remaining_budget, total_budget=total_budget,
-                           previous_months_budgets=previous_months_budgets, plot_data=plot_data, 
-                           plot_data_by_category=plot_data_by_category)
+    return plot_data
+
+
+@job_queue.handler('budget_charts', lane='high')
+def budget_charts_job(user_id, month, year):
+    transactions = Transaction.query.filter(
+        Transaction.user_id == user_id,
+        func.extract('month', Transaction.date) == month,
+        func.extract('year', Transaction.date) == year
+    ).all()
+
+    previous_months_budgets = calculate_previous_months_budgets(user_id, month, year)
+
+    return {
+        'plot_data': plot_remaining_budget_over_months(previous_months_budgets),
+        'plot_data_by_category': plot_spending_by_category(transactions),
+    }
+
+
+@job_queue.handler('import_transactions')
+def import_transactions_job(user_id, rows):
+    import_transactions(user_id, rows)
+    return {'imported': len(rows)}
+
+
+@job_queue.handler('clear_history', lane='low')
+def clear_history_job(user_id):
+    deleted = Transaction.query.filter_by(user_id=user_id).delete()
+    TransactionSummary.query.filter_by(user_id=user_id).delete()
+    deleted += delete_archived_rows(transaction_connection(), Transaction.__table__, user_id)
+    db.session.commit()
+    user_cache.bump_version(user_id)
+    return {'deleted': deleted}
+
+
+def job_stalled(job):
+    return (job['status'] == 'queued' and job['attempts'] == 0
+            and time.time() - job['run_after'] > app.config['JOB_STALLED_SECONDS'])
+
+
+@app.route('/jobs/<int:job_id>', methods=['GET'])
+@login_required
+def job_status(job_id):
+    job = job_queue.get(job_id)
+    if job is None or job['user_id'] != current_user.id:
+        return jsonify({'error': 'Job not found.'}), 404
+
+    return jsonify({
+        'id': job['id'],
+        'kind': job['kind'],
+        'lane': job['lane'],
+        'status': job['status'],
+        'attempts': job['attempts'],
+        'error': job['error'] if job['status'] == 'failed' else None,
+        'stalled': job_stalled(job),
+    })
 
 
 @login_manager.user_loader
@@ -383,6 +749,69 @@ def load_user(user_id):
         return None
 
 
+@app.template_global()
+def asset_url(filename):
+    if filename in asset_manifest:
+        return url_for('assets', filename=asset_manifest[filename])
+    return url_for('static', filename=filename)
+
+
+@app.route('/assets/<path:filename>')
+def assets(filename):
+    # Fingerprinted files never change, so browsers may keep them forever
+    available = [encoding for encoding, suffix in ENCODING_SUFFIXES.items()
+                 if os.path.exists(os.path.join(ASSET_DIR, filename + suffix))]
+    encoding = negotiate(request.accept_encodings, available)
+
+    max_age = 365 * 24 * 60 * 60
+
+    if encoding:
+        response = send_from_directory(ASSET_DIR, filename + ENCODING_SUFFIXES[encoding],
+                                       mimetype=mimetypes.guess_type(filename)[0], max_age=max_age)
+        response.content_encoding = encoding
+    else:
+        response = send_from_directory(ASSET_DIR, filename, max_age=max_age)
+
+    response.vary.add('Accept-Encoding')
+    response.cache_control.immutable = True
+    return response
+
+
+@app.after_request
+def compress_response(response):
+    if (response.content_encoding or response.direct_passthrough
+            or response.mimetype not in app.config['COMPRESS_MIMETYPES']):
+        return response
+
+    response.vary.add('Accept-Encoding')
+
+    if response.is_streamed:
+        # Streamed pages are gzipped chunk by chunk so they still flush early
+        if negotiate(request.accept_encodings, ['gzip']):
+            response.response = gzip_stream(response.response)
+            response.content_encoding = 'gzip'
+            response.headers.pop('Content-Length', None)
+        return response
+
+    data = response.get_data()
+    if len(data) < app.config['COMPRESS_MIN_SIZE']:
+        return response
+
+    encoding = negotiate(request.accept_encodings)
+    if encoding:
+        response.set_data(compress(data, encoding))
+        response.content_encoding = encoding
+    return response
+
+
+@app.before_request
+def route_to_user_shard():
+    # Send this request's Transaction/Budget/Subscription queries to the user's shard
+    if request.endpoint in ('static', 'assets'):
+        return
+    shard_router.activate(current_user.id if current_user.is_authenticated else None)
+
+
 @app.route('/', methods=['GET', 'POST'])
 def index():
     print("Form submitted to /set_budget")
@@ -395,6 +824,10 @@ def index():
         username = request.form['username']
         password = request.form['password']
 
+        if not login_attempt_allowed(username):
+            flash('Too many login attempts. Please wait a minute and try again.', 'error')
+            return render_template('login.html'), 429
+
         user = User.query.filter_by(username=username).first()
 
         if user and user.check_password(password):
@@ -403,6 +836,15 @@ def index():
 
     return render_template('login.html')
 
+@app.route('/rate_limits', methods=['GET'])
+@login_required
+def rate_limits():
+    # Allowed/rejected counters for this worker process
+    return jsonify({
+        'login_ip': login_ip_limiter.stats(),
+        'login_username': login_username_limiter.stats(),
+    })
+
 @app.route('/index', methods=['GET'])
 def render_index():
     return render_template('index.html')
@@ -440,6 +882,7 @@ def set_budget():
         current_user.budget = new_budget
 
         db.session.commit()
+        user_cache.bump_version(current_user.id)
         flash('Monthly budget set successfully!', 'success')
     except ValueError as e:
         flash(f'Error: {str(e)}', 'error')
@@ -454,63 +897,79 @@ def transactions():
         # Handle POST request for transactions, if needed
         pass
 
-    # Retrieve the user's transactions
-    transactions = current_user.transactions
+    # Retrieve the user's transactions, including archived ones
+    rows, stream = transaction_rows_fragment('transactions', '_transaction_rows.html',
+                                             lambda: get_all_transactions(current_user.id))
+
+    return render_transaction_page('transactions.html', rows, stream)
+
+
+def import_transactions(user_id, rows):
+    # Create a Pandas DataFrame from the form rows
+    df = pd.DataFrame(rows, columns=['category', 'amount', 'date'])
+
+    # Iterate over the DataFrame rows and add transactions to the database
+    for _, row in df.iterrows():
+        new_transaction = Transaction(
+            user_id=user_id,
+            category=row['category'],
+            amount=float(row['amount']),
+            date=datetime.strptime(row['date'], '%Y-%m-%d').date()
+        )
+        db.session.add(new_transaction)
 
-    return render_template('transactions.html', transactions=transactions)
+    # Commit the changes to the database
+    db.session.commit()
+    user_cache.bump_version(user_id)
 
 
 @app.route('/add_transactions', methods=['GET', 'POST'])
 @login_required
 def add_transactions():
-    if request.method == 'POST':
-        # Sample data with empty lists
-        sample_data = {
-            'category': request.form.getlist('category'),  # Use request.form to get form data
-            'amount': request.form.getlist('amount'),
-            'date': request.form.getlist('date')
-        }
-
-       
-        with current_app.test_request_context():
-            user = User.query.get(current_user.id)
-
-            # Create a Pandas DataFrame from the sample data
-            df = pd.DataFrame(sample_data)
-
-            # Iterate over the DataFrame rows and add transactions to the database
-            for _, row in df.iterrows():
-                new_transaction = Transaction(
-                    user_id=user.id,
-                    category=row['category'],
-                    amount=row['amount'],
-                    date=datetime.strptime(row['date'], '%Y-%m-%d').date()
-                )
-                db.session.add(new_transaction)
-
-            # Commit the changes to the database
-            db.session.commit()
+    import_job_id = None
 
+    if request.method == 'POST':
+        rows = [
+            {'category': category, 'amount': amount, 'date': date}
+            for category, amount, date in zip(request.form.getlist('category'),
+                                              request.form.getlist('amount'),
+                                              request.form.getlist('date'))
+        ]
+
+        if len(rows) >= app.config['BACKGROUND_IMPORT_THRESHOLD']:
+            # Large imports go to the worker so this request returns straight away
+            import_job_id = job_queue.enqueue('import_transactions', user_id=current_user.id, rows=rows)
+        else:
+            import_transactions(current_user.id, rows)
             flash('Transactions added successfully!', 'success')
 
    
-    transactions = current_user.transactions
+    rows, stream = transaction_rows_fragment('new_transactions', '_transaction_table_rows.html',
+                                             lambda: current_user.transactions)
 
    
-    return render_template('index.html', transactions=transactions)
+    return render_transaction_page('index.html', rows, stream, import_job_id=import_job_id)
 
 
+@app.route('/delete_transaction', methods=['POST'], defaults={'transaction_id': None})
 @app.route('/delete_transaction/<int:transaction_id>', methods=['POST'])
 @login_required
 def delete_transaction(transaction_id):
     if request.method == 'POST':
-        
+        # The transactions page posts one shared form with the row's id on the clicked button
+        if transaction_id is None:
+            transaction_id = request.form.get('transaction_id', type=int)
+            if transaction_id is None:
+                flash('Please choose a transaction to delete.', 'error')
+                return redirect(url_for('transactions'))
+
         transaction = Transaction.query.get_or_404(transaction_id)
 
         
         if transaction.user_id == current_user.id:
             db.session.delete(transaction)
             db.session.commit()
+            user_cache.bump_version(current_user.id)
             flash('Transaction deleted successfully!', 'success')
         else:
             flash('You are not authorized to delete this transaction.', 'error')
@@ -546,6 +1005,7 @@ def monthly_subscription_billing(user, db):
 
         # Commit the changes to the database
         db.session.commit()
+        user_cache.bump_version(user.id)
         flash('Monthly subscription billing completed successfully!', 'success')
 
 
@@ -571,6 +1031,7 @@ def add_subscription():
         )
         db.session.add(new_subscription)
         db.session.commit()
+        user_cache.bump_version(current_user.id)
         flash(f'Subscription "{new_subscription_name}" added successfully!', 'success')
 
         # Check if any subscriptions need to be canceled
@@ -580,6 +1041,7 @@ def add_subscription():
             if subscription:
                 subscription.is_active = False
                 db.session.commit()
+                user_cache.bump_version(current_user.id)
                 flash(f'Subscription "{subscription.name}" canceled successfully!', 'success')
 
         return redirect(url_for('add_subscription'))
@@ -610,6 +1072,7 @@ def cancel_subscription():
 
         # Commit changes to the database
         db.session.commit()
+        user_cache.bump_version(current_user.id)
 
         flash('Subscriptions canceled successfully!', 'success')
     except Exception as e:
@@ -633,13 +1096,129 @@ def reset_budgets():
 
     # Check if it's the first day of the month
     if current_date.day == 1:
-        # Reset the budget for all users
-        users = User.query.all()
-        for user in users:
-            user.budget = 0.0
-        db.session.commit()
+        # Reset the budget for all users (the user table is not sharded)
+        with app.app_context():
+            User.query.update({User.budget: 0.0})
+            db.session.commit()
+
+            user_cache.bump_versions([user_id for (user_id,) in db.session.query(User.id)])
+
+
+def bill_due_subscriptions():
+    # Add today's charge for every active subscription on the current shard
+    today = datetime.now().date()
+    due_subscriptions = Subscription.query.filter_by(is_active=True, billing_date=today.day)
+
+    # Billing dates past the end of a short month are charged on its last day, like the projection
+    if today.day == calendar.monthrange(today.year, today.month)[1]:
+        due_subscriptions = Subscription.query.filter(
+            Subscription.is_active == True,
+            Subscription.billing_date >= today.day
+        )
+
+    due_subscriptions = due_subscriptions.all()
+
+    for subscription in due_subscriptions:
+        db.session.add(Transaction(
+            user_id=subscription.user_id,
+            category='Subscription',
+            amount=subscription.billing_amount,
+            date=today
+        ))
+
+    db.session.commit()
+
+    user_cache.bump_versions({subscription.user_id for subscription in due_subscriptions})
+
+    return len(due_subscriptions)
+
+
+def run_subscription_billing():
+    # Bill every shard in parallel
+    return sum(fan_out(app, shard_router, bill_due_subscriptions))
+
+
+def archive_old_transactions():
+    # Move transactions older than the horizon out of the hot table on the current shard
+    now = datetime.now()
+    months_back = now.year * 12 + now.month - 1 - app.config['ARCHIVE_HORIZON_MONTHS']
+    cutoff = datetime(months_back // 12, months_back % 12 + 1, 1).date()
+
+    archived = archive_rows(transaction_connection(), Transaction.__table__, cutoff)
+
+    # Fold the archived rows into the monthly summaries
+    totals = {}
+    for row in archived:
+        key = (row['user_id'], row['date'].year, row['date'].month, row['category'])
+        total, count = totals.get(key, (0.0, 0))
+        totals[key] = (total + row['amount'], count + 1)
+
+    for (user_id, year, month, category), (total, count) in totals.items():
+        summary = TransactionSummary.query.filter_by(
+            user_id=user_id, year=year, month=month, category=category
+        ).first()
+        if summary is None:
+            summary = TransactionSummary(user_id=user_id, year=year, month=month, category=category,
+                                         total=0.0, count=0)
+            db.session.add(summary)
+        summary.total += total
+        summary.count += count
+
+    db.session.commit()
+
+    user_cache.bump_versions({row['user_id'] for row in archived})
+
+    return len(archived)
+
+
+def run_transaction_archival():
+    current_date = datetime.now()
+
+    # Archive once a month, on every shard in parallel
+    if current_date.day == 1:
+        return sum(fan_out(app, shard_router, archive_old_transactions))
+    return 0
+
+
+@app.cli.command('archive-transactions')
+def archive_transactions_command():
+    """Move transactions older than ARCHIVE_HORIZON_MONTHS into yearly archive tables."""
+    archived = sum(fan_out(app, shard_router, archive_old_transactions))
+    click.echo(f'Archived {archived} transaction(s).')
+
+
+@app.cli.command('purge-jobs')
+@click.option('--hours', type=float, default=None,
+              help='Delete done and failed jobs older than this (default FINANCE_JOB_RETENTION_HOURS).')
+def purge_jobs_command(hours):
+    """Delete finished and failed background jobs from the job queue."""
+    purged = job_queue.purge(hours * 60 * 60 if hours is not None else None)
+    click.echo(f'Purged {purged} job(s).')
+
+
+@app.cli.command('create-shards')
+def create_shards_command():
+    """Create the per-user tables in every shard database."""
+    create_shard_tables(db, shard_router)
+    click.echo(f'Created tables in {shard_router.count} shard(s).')
+
+
+@app.cli.command('rebalance-shards')
+@click.option('--previous-count', default=0,
+              help='Shard count before this change, if it was larger (needed when shrinking or going back to 0).')
+def rebalance_shards_command(previous_count):
+    """Move rows to the shard that owns their user under FINANCE_SHARD_COUNT (0 = back into finance.db).
+
+    Stop the app and any workers first; writes made during the move can be left on the old shard.
+    """
+    moved = rebalance(app, db, shard_router, previous_count=previous_count)
+    for table_name, count in moved.items():
+        click.echo(f'{table_name}: moved {count} row(s)')
+    click.echo('Rebalance complete.')
 
 schedule.every().day.at("00:00").do(reset_budgets)
+schedule.every().day.at("00:05").do(run_subscription_billing)
+schedule.every().day.at("01:00").do(run_transaction_archival)
 
 def run_scheduled_jobs():
     while True:
@@ -650,5 +1229,8 @@ if __name__ == '__main__':
     job_thread = Thread(target=run_scheduled_jobs)
     job_thread.start()
 
+    # Run background jobs in-process too; deployments run worker.py instead
+    Thread(target=job_queue.work, daemon=True).start()
+
     # Run the Flask app
     app.run(debug=True)
\ No newline at end of file
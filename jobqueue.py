@@ -0,0 +1,208 @@
+"""A small persistent job queue stored in SQLite.
+
+Web requests ``enqueue`` work and return straight away; ``worker.py`` processes
+claim jobs and run the registered handlers. Jobs are claimed inside a
+``BEGIN IMMEDIATE`` transaction so several workers can share one queue file,
+and a claimed job holds a lease so work from a crashed worker is picked up
+again. Failed jobs are retried with exponential backoff up to
+``max_attempts``. Lanes give priorities: ``high`` jobs always run before
+``default`` ones, which run before ``low`` ones. Finished and failed jobs are
+deleted once they are older than ``retention_seconds``.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import traceback
+
+
+LANES = {'high': 0, 'default': 1, 'low': 2}
+LANE_NAMES = {priority: name for name, priority in LANES.items()}
+
+# How often a worker deletes expired jobs
+PURGE_INTERVAL = 60 * 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS job (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    lane INTEGER NOT NULL,
+    user_id INTEGER,
+    payload TEXT NOT NULL,
+    dedupe_key TEXT UNIQUE,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    run_after REAL NOT NULL,
+    lease_expires REAL,
+    result TEXT,
+    error TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_job_claim ON job (status, lane, run_after);
+"""
+
+
+class JobHandler:
+    def __init__(self, func, lane, max_attempts):
+        self.func = func
+        self.lane = lane
+        self.max_attempts = max_attempts
+
+
+class JobQueue:
+    def __init__(self, path, runner=None, lease_seconds=300, retention_seconds=24 * 60 * 60):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.retention_seconds = retention_seconds
+        # Called as runner(func, job) so the app can set up contexts around every job
+        self.runner = runner or (lambda func, job: func(job['user_id'], **job['payload']))
+        self.handlers = {}
+        self._local = threading.local()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        connection = self._connect()
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.executescript(SCHEMA)
+
+    def _connect(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.row_factory = sqlite3.Row
+            self._local.connection = connection
+        return connection
+
+    def handler(self, kind, lane='default', max_attempts=3):
+        def register(func):
+            self.handlers[kind] = JobHandler(func, LANES[lane], max_attempts)
+            return func
+        return register
+
+    def enqueue(self, kind, user_id=None, dedupe_key=None, lane=None, **payload):
+        """Queue a job and return its id.
+
+        With a ``dedupe_key`` an existing job with the same key is reused
+        instead, unless it failed for good, in which case it is queued again.
+        """
+        handler = self.handlers[kind]
+        priority = LANES[lane] if lane else handler.lane
+        now = time.time()
+
+        connection = self._connect()
+        connection.execute(
+            'INSERT INTO job (kind, lane, user_id, payload, dedupe_key, status, max_attempts, run_after, created, updated) '
+            "VALUES (?, ?, ?, ?, ?, 'queued', ?, ?, ?, ?) "
+            "ON CONFLICT (dedupe_key) DO UPDATE SET status = 'queued', attempts = 0, error = NULL, "
+            "run_after = excluded.run_after, updated = excluded.updated WHERE job.status = 'failed'",
+            (kind, priority, user_id, json.dumps(payload), dedupe_key, handler.max_attempts, now, now, now)
+        )
+        if dedupe_key is None:
+            return connection.execute('SELECT last_insert_rowid()').fetchone()[0]
+        return connection.execute('SELECT id FROM job WHERE dedupe_key = ?', (dedupe_key,)).fetchone()[0]
+
+    def _row_to_job(self, row):
+        if row is None:
+            return None
+        job = dict(row)
+        job['payload'] = json.loads(job['payload'])
+        job['result'] = json.loads(job['result']) if job['result'] is not None else None
+        job['lane'] = LANE_NAMES[job['lane']]
+        return job
+
+    def get(self, job_id):
+        row = self._connect().execute('SELECT * FROM job WHERE id = ?', (job_id,)).fetchone()
+        return self._row_to_job(row)
+
+    def claim(self, lanes=None):
+        now = time.time()
+        query = ("SELECT * FROM job WHERE ((status = 'queued' AND run_after <= ?) "
+                 "OR (status = 'running' AND lease_expires < ?))")
+        params = [now, now]
+        if lanes:
+            query += f" AND lane IN ({', '.join('?' for _ in lanes)})"
+            params.extend(LANES[lane] for lane in lanes)
+        query += ' ORDER BY lane, run_after, id LIMIT 1'
+
+        connection = self._connect()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = connection.execute(query, params).fetchone()
+            if row is not None:
+                connection.execute(
+                    "UPDATE job SET status = 'running', attempts = attempts + 1, lease_expires = ?, updated = ? "
+                    'WHERE id = ?',
+                    (now + self.lease_seconds, now, row['id'])
+                )
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+
+        if row is None:
+            return None
+        job = self._row_to_job(row)
+        job['attempts'] += 1
+        return job
+
+    def complete(self, job_id, result=None):
+        self._connect().execute(
+            "UPDATE job SET status = 'done', result = ?, error = NULL, lease_expires = NULL, updated = ? WHERE id = ?",
+            (json.dumps(result), time.time(), job_id)
+        )
+
+    def fail(self, job, error):
+        now = time.time()
+        if job['attempts'] < job['max_attempts']:
+            # Back off 5s, 10s, 20s, ... capped at 5 minutes
+            retry_at = now + min(300, 5 * 2 ** (job['attempts'] - 1))
+            self._connect().execute(
+                "UPDATE job SET status = 'queued', run_after = ?, error = ?, lease_expires = NULL, updated = ? "
+                'WHERE id = ?',
+                (retry_at, error, now, job['id'])
+            )
+        else:
+            self._connect().execute(
+                "UPDATE job SET status = 'failed', error = ?, lease_expires = NULL, updated = ? WHERE id = ?",
+                (error, now, job['id'])
+            )
+
+    def run_next(self, lanes=None):
+        """Run one job if any is due; return whether one was found."""
+        job = self.claim(lanes)
+        if job is None:
+            return False
+
+        handler = self.handlers.get(job['kind'])
+        if handler is None:
+            self.fail(dict(job, attempts=job['max_attempts']), f"No handler registered for {job['kind']!r}")
+            return True
+
+        try:
+            result = self.runner(handler.func, job)
+        except Exception:
+            self.fail(job, traceback.format_exc())
+        else:
+            self.complete(job['id'], result)
+        return True
+
+    def purge(self, older_than=None):
+        """Delete done and failed jobs not updated for ``older_than`` seconds; return how many."""
+        if older_than is None:
+            older_than = self.retention_seconds
+        cursor = self._connect().execute(
+            "DELETE FROM job WHERE status IN ('done', 'failed') AND updated < ?",
+            (time.time() - older_than,)
+        )
+        return cursor.rowcount
+
+    def work(self, lanes=None, poll_interval=1.0, stop_event=None):
+        next_purge = 0
+        while stop_event is None or not stop_event.is_set():
+            if time.time() >= next_purge:
+                self.purge()
+                next_purge = time.time() + PURGE_INTERVAL
+            if not self.run_next(lanes):
+                time.sleep(poll_interval)
@@ -0,0 +1,325 @@
+"""Load test finance_UI under gunicorn and report where it saturates.
+
+Starts the app in a throwaway instance folder under a multi-worker gunicorn
+server with worker.py processes for the background jobs, registers a pool of
+users, then replays a mix of login, dashboard, add-transaction, budget_info
+and subscription traffic at increasing concurrency. For every step it reports
+throughput, latency percentiles, errors, SQLite "database is locked" errors
+seen in the server log and server CPU time per request, and flags the knee of
+the curve.
+
+    pip install gunicorn
+    python loadtest.py --workers 4 --steps 1,2,4,8,16,32 --duration 20
+"""
+import argparse
+import http.cookiejar
+import json
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import date, timedelta
+
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+PASSWORD = 'LoadTest123'
+
+# (weight, action name)
+TRAFFIC_MIX = [
+    (35, 'dashboard'),
+    (20, 'add_transaction'),
+    (10, 'budget_info'),
+    (10, 'transactions'),
+    (10, 'subscriptions'),
+    (5, 'add_subscription'),
+    (10, 'login'),
+]
+
+# The next step is past the knee once throughput grows by less than this fraction
+KNEE_THROUGHPUT_GAIN = 0.10
+KNEE_ERROR_RATE = 0.01
+
+CREATE_TABLES = (
+    'from finance_UI import app, db, shard_router\n'
+    'from sharding import create_shard_tables\n'
+    'with app.app_context():\n'
+    '    db.create_all()\n'
+    '    create_shard_tables(db, shard_router)\n'
+)
+
+
+class VirtualUser:
+    def __init__(self, base_url, username):
+        self.base_url = base_url
+        self.username = username
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar())
+        )
+
+    def request(self, path, data=None):
+        body = urllib.parse.urlencode(data, doseq=True).encode('utf-8') if data is not None else None
+        try:
+            with self.opener.open(self.base_url + path, data=body, timeout=60) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+    def register(self):
+        return self.request('/register', {
+            'username': self.username, 'password': PASSWORD, 'confirm_password': PASSWORD
+        })
+
+    def login(self):
+        return self.request('/login', {'username': self.username, 'password': PASSWORD})
+
+    def run(self, action):
+        if action == 'dashboard':
+            return self.request('/dashboard')
+        if action == 'add_transaction':
+            day = date.today() - timedelta(days=random.randint(0, 60))
+            return self.request('/add_transactions', {
+                'category': random.choice(['Food', 'Rent', 'Travel', 'Fun']),
+                'amount': f'{random.uniform(1, 200):.2f}',
+                'date': day.isoformat(),
+            })
+        if action == 'budget_info':
+            return self.request('/budget_info')
+        if action == 'transactions':
+            return self.request('/transactions')
+        if action == 'subscriptions':
+            return self.request('/add_subscription')
+        if action == 'add_subscription':
+            return self.request('/add_subscription', {
+                'name': 'Streaming', 'billing_amount': '9.99', 'billing_date': str(random.randint(1, 28))
+            })
+        if action == 'login':
+            return self.login()
+        raise ValueError(f'Unknown action: {action}')
+
+
+def pick_action():
+    total = sum(weight for weight, _ in TRAFFIC_MIX)
+    point = random.uniform(0, total)
+    for weight, action in TRAFFIC_MIX:
+        point -= weight
+        if point <= 0:
+            return action
+    return TRAFFIC_MIX[-1][1]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_server(base_url, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(base_url + '/register', timeout=2).read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f'Server did not start within {timeout}s')
+
+
+def server_pids(master_pid):
+    pids = [master_pid]
+    try:
+        for task in os.listdir(f'/proc/{master_pid}/task'):
+            with open(f'/proc/{master_pid}/task/{task}/children') as children:
+                pids.extend(int(pid) for pid in children.read().split())
+    except OSError:
+        pass
+    return pids
+
+
+def server_cpu_seconds(root_pids):
+    # utime + stime of gunicorn, its workers and the job workers, from /proc (Linux only)
+    ticks = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+    total = 0
+    for pid in [pid for root_pid in root_pids for pid in server_pids(root_pid)]:
+        try:
+            with open(f'/proc/{pid}/stat') as stat:
+                fields = stat.read().rsplit(')', 1)[1].split()
+            total += int(fields[11]) + int(fields[12])
+        except (OSError, IndexError, ValueError):
+            return None
+    return total / ticks
+
+
+def count_lock_errors(log_path, offset):
+    with open(log_path, 'rb') as log:
+        log.seek(offset)
+        text = log.read().decode('utf-8', 'replace')
+        return text.count('database is locked'), log.tell()
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(fraction * (len(values) - 1))))
+    return values[index]
+
+
+def run_step(users, concurrency, duration):
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+    stop_at = time.time() + duration
+
+    def worker(index):
+        nonlocal errors
+        user = users[index % len(users)]
+        while time.time() < stop_at:
+            action = pick_action()
+            started = time.perf_counter()
+            try:
+                status = user.run(action)
+            except OSError:
+                status = 599
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                if status >= 500:
+                    errors += 1
+
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(concurrency)]
+    started = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors, time.time() - started
+
+
+def find_knee(results):
+    # The last concurrency level before throughput flattens out or errors appear
+    for previous, current in zip(results, results[1:]):
+        if current['error_rate'] > KNEE_ERROR_RATE:
+            return previous['concurrency']
+        if current['throughput'] < previous['throughput'] * (1 + KNEE_THROUGHPUT_GAIN):
+            return previous['concurrency']
+    return None
+
+
+def print_report(results, knee):
+    header = f"{'conc':>5} {'req/s':>8} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'errors':>7} {'locked':>7} {'cpu ms/req':>11}"
+    print(header)
+    print('-' * len(header))
+    for result in results:
+        cpu = f"{result['cpu_ms_per_request']:.1f}" if result['cpu_ms_per_request'] is not None else 'n/a'
+        marker = '  <- knee' if result['concurrency'] == knee else ''
+        print(f"{result['concurrency']:>5} {result['throughput']:>8.1f} {result['p50_ms']:>8.1f} "
+              f"{result['p90_ms']:>8.1f} {result['p99_ms']:>8.1f} {result['errors']:>7} "
+              f"{result['lock_errors']:>7} {cpu:>11}{marker}")
+    if knee is None:
+        print('No knee found: throughput was still scaling at the highest concurrency.')
+    else:
+        print(f'Knee at concurrency {knee}: throughput stops scaling or errors appear beyond this point.')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn worker processes')
+    parser.add_argument('--threads', type=int, default=1, help='threads per gunicorn worker')
+    parser.add_argument('--steps', default='1,2,4,8,16,32', help='comma separated concurrency levels')
+    parser.add_argument('--duration', type=float, default=20, help='seconds per concurrency step')
+    parser.add_argument('--users', type=int, default=50, help='number of registered test users')
+    parser.add_argument('--job-workers', type=int, default=1, help='worker.py processes for background jobs')
+    parser.add_argument('--shards', type=int, default=0, help='FINANCE_SHARD_COUNT for the server')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    steps = [int(step) for step in args.steps.split(',')]
+    instance_path = tempfile.mkdtemp(prefix='finance_loadtest_')
+    log_path = os.path.join(instance_path, 'server.log')
+    port = free_port()
+    base_url = f'http://127.0.0.1:{port}'
+
+    env = dict(os.environ)
+    env.update({
+        'FINANCE_INSTANCE_PATH': instance_path,
+        'FINANCE_SHARD_COUNT': str(args.shards),
+        # Every virtual user shares one IP, so lift the login limits out of the way
+        'LOGIN_RATE_LIMIT_PER_IP': '1000000/1',
+        'LOGIN_RATE_LIMIT_PER_USERNAME': '1000000/1',
+    })
+    subprocess.run([sys.executable, '-c', CREATE_TABLES], cwd=APP_DIR, env=env, check=True)
+
+    with open(log_path, 'wb') as log:
+        server = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '--workers', str(args.workers), '--threads', str(args.threads),
+             '--bind', f'127.0.0.1:{port}', 'finance_UI:app'],
+            cwd=APP_DIR, env=env, stdout=log, stderr=subprocess.STDOUT
+        )
+        job_workers = [
+            subprocess.Popen([sys.executable, 'worker.py'], cwd=APP_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+            for _ in range(args.job_workers)
+        ]
+    root_pids = [server.pid] + [worker.pid for worker in job_workers]
+
+    results = []
+    try:
+        wait_for_server(base_url)
+        print(f'Server: gunicorn, {args.workers} worker(s) x {args.threads} thread(s), '
+              f'{args.job_workers} job worker(s), instance {instance_path}')
+
+        users = [VirtualUser(base_url, f'loadtest{index}') for index in range(args.users)]
+        for user in users:
+            user.register()
+            user.login()
+
+        log_offset = os.path.getsize(log_path)
+        for concurrency in steps:
+            cpu_before = server_cpu_seconds(root_pids)
+            latencies, errors, elapsed = run_step(users, concurrency, args.duration)
+            cpu_after = server_cpu_seconds(root_pids)
+            lock_errors, log_offset = count_lock_errors(log_path, log_offset)
+
+            requests_made = len(latencies)
+            cpu_ms_per_request = None
+            if cpu_before is not None and cpu_after is not None and requests_made:
+                cpu_ms_per_request = (cpu_after - cpu_before) * 1000 / requests_made
+
+            results.append({
+                'concurrency': concurrency,
+                'requests': requests_made,
+                'throughput': requests_made / elapsed,
+                'p50_ms': percentile(latencies, 0.50) * 1000,
+                'p90_ms': percentile(latencies, 0.90) * 1000,
+                'p99_ms': percentile(latencies, 0.99) * 1000,
+                'errors': errors,
+                'error_rate': errors / requests_made if requests_made else 0.0,
+                'lock_errors': lock_errors,
+                'cpu_ms_per_request': cpu_ms_per_request,
+            })
+            print(f'  concurrency {concurrency}: {requests_made} requests in {elapsed:.1f}s')
+    finally:
+        for process in [server] + job_workers:
+            process.send_signal(signal.SIGTERM)
+        for process in [server] + job_workers:
+            process.wait(timeout=30)
+
+    knee = find_knee(results)
+    print()
+    print_report(results, knee)
+
+    if args.json:
+        with open(args.json, 'w') as output:
+            json.dump({'settings': vars(args), 'results': results, 'knee': knee}, output, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,37 @@
+"""Add transaction summary table and (user_id, date) index
+
+Revision ID: 4c2e8a1d9b73
+Revises: 1f7d359afb14
+Create Date: 2026-10-19 09:12:04.518221
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4c2e8a1d9b73'
+down_revision = '1f7d359afb14'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('transaction_summary',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('year', sa.Integer(), nullable=False),
+    sa.Column('month', sa.Integer(), nullable=False),
+    sa.Column('category', sa.String(length=50), nullable=False),
+    sa.Column('total', sa.Float(), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('user_id', 'year', 'month', 'category')
+    )
+    op.create_index('ix_transaction_user_id_date', 'transaction', ['user_id', 'date'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_transaction_user_id_date', table_name='transaction')
+    op.drop_table('transaction_summary')
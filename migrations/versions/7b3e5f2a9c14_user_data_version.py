@@ -0,0 +1,31 @@
+"""Add user_data_version table for cache invalidation
+
+Revision ID: 7b3e5f2a9c14
+Revises: 4c2e8a1d9b73
+Create Date: 2026-10-19 14:37:51.204118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7b3e5f2a9c14'
+down_revision = '4c2e8a1d9b73'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('user_data_version',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('user_id')
+    )
+
+
+def downgrade():
+    op.drop_table('user_data_version')
@@ -0,0 +1,36 @@
+"""Vectorized expansion of monthly subscriptions into upcoming charges."""
+import numpy as np
+
+
+def project_charges(names, amounts, billing_days, today, months=1):
+    """Return the charges due after ``today`` through the end of the ``months``-th month.
+
+    ``months=1`` covers the rest of the current month. Every subscription is
+    expanded for every month at once as a (months x subscriptions) grid; billing
+    days past the end of a short month fall on its last day.
+    """
+    if not len(names):
+        return []
+
+    amounts = np.asarray(amounts, dtype=float)
+    billing_days = np.asarray(billing_days, dtype=int)
+
+    month_starts = np.datetime64(today, 'M') + np.arange(months)
+    first_days = month_starts.astype('datetime64[D]')
+    days_in_month = ((month_starts + 1).astype('datetime64[D]') - first_days).astype(int)
+
+    due_days = np.minimum(billing_days[np.newaxis, :], days_in_month[:, np.newaxis])
+    due_dates = first_days[:, np.newaxis] + (due_days - 1)
+    upcoming = due_dates > np.datetime64(today, 'D')
+
+    month_index, subscription_index = np.nonzero(upcoming)
+    order = np.argsort(due_dates[month_index, subscription_index], kind='stable')
+
+    return [
+        {
+            'name': names[subscription_index[i]],
+            'amount': float(amounts[subscription_index[i]]),
+            'date': str(due_dates[month_index[i], subscription_index[i]]),
+        }
+        for i in order
+    ]
@@ -0,0 +1,157 @@
+"""Token-bucket rate limiting with pluggable bucket stores.
+
+Each key (an IP address, a username, ...) gets a bucket of ``capacity`` tokens
+that refills at ``refill_rate`` tokens per second; a request is allowed when a
+whole token can be taken. The in-process store is shared by every thread of a
+worker. Use the SQLite or Redis store to share buckets between workers.
+"""
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+# How often the SQLite store deletes buckets that have refilled completely
+SQLITE_PURGE_INTERVAL = 60
+
+def _take_token(tokens, updated, capacity, refill_rate, now):
+    tokens = min(capacity, tokens + (now - updated) * refill_rate)
+    if tokens >= 1:
+        return True, tokens - 1
+    return False, tokens
+
+
+class MemoryBucketStore:
+    def __init__(self, max_keys=10000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def consume(self, key, capacity, refill_rate, now):
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (capacity, now))
+            allowed, tokens = _take_token(tokens, updated, capacity, refill_rate, now)
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            # Forgetting the oldest bucket only ever refills it early
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return allowed
+
+
+class SQLiteBucketStore:
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._next_purge = 0
+        connection = self._connect()
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS rate_limit_bucket '
+            '(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL, expires REAL NOT NULL)'
+        )
+        connection.execute('CREATE INDEX IF NOT EXISTS ix_rate_limit_bucket_expires ON rate_limit_bucket (expires)')
+
+    def _connect(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            self._local.connection = connection
+        return connection
+
+    def consume(self, key, capacity, refill_rate, now):
+        connection = self._connect()
+        # BEGIN IMMEDIATE takes the write lock up front so workers can't race on a bucket
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = connection.execute(
+                'SELECT tokens, updated FROM rate_limit_bucket WHERE key = ?', (key,)
+            ).fetchone()
+            tokens, updated = row if row else (capacity, now)
+            allowed, tokens = _take_token(tokens, updated, capacity, refill_rate, now)
+            # A bucket is full again by ``expires``, so dropping it then changes nothing
+            connection.execute(
+                'INSERT OR REPLACE INTO rate_limit_bucket (key, tokens, updated, expires) VALUES (?, ?, ?, ?)',
+                (key, tokens, now, now + (capacity - tokens) / refill_rate)
+            )
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+
+        if now >= self._next_purge:
+            self._next_purge = now + SQLITE_PURGE_INTERVAL
+            self.purge(now)
+        return allowed
+
+    def purge(self, now=None):
+        """Delete buckets that have refilled completely; return how many."""
+        if now is None:
+            now = time.time()
+        return self._connect().execute('DELETE FROM rate_limit_bucket WHERE expires <= ?', (now,)).rowcount
+
+
+_REDIS_TAKE_TOKEN = """
+local capacity = tonumber(ARGV[1])
+local refill_rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or capacity
+local updated = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + (now - updated) * refill_rate)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / refill_rate) + 1)
+return allowed
+"""
+
+
+class RedisBucketStore:
+    def __init__(self, url):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError('The redis package is required for a redis:// rate limit store.') from e
+
+        self._take_token = redis.Redis.from_url(url).register_script(_REDIS_TAKE_TOKEN)
+
+    def consume(self, key, capacity, refill_rate, now):
+        return bool(self._take_token(keys=[f'rate_limit:{key}'], args=[capacity, refill_rate, now]))
+
+
+def make_bucket_store(url=None):
+    if not url:
+        return MemoryBucketStore()
+    if url.startswith('sqlite:///'):
+        path = url[len('sqlite:///'):]
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        return SQLiteBucketStore(path)
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisBucketStore(url)
+    raise ValueError(f'Unsupported rate limit store: {url}')
+
+
+class RateLimiter:
+    def __init__(self, store, capacity, per_seconds):
+        self.store = store
+        self.capacity = capacity
+        self.refill_rate = capacity / per_seconds
+        self.allowed = 0
+        self.rejected = 0
+        self._counter_lock = threading.Lock()
+
+    def hit(self, key):
+        allowed = self.store.consume(key, self.capacity, self.refill_rate, time.time())
+        with self._counter_lock:
+            if allowed:
+                self.allowed += 1
+            else:
+                self.rejected += 1
+        return allowed
+
+    def stats(self):
+        return {'allowed': self.allowed, 'rejected': self.rejected}
@@ -0,0 +1,235 @@
+"""Horizontal sharding of per-user tables across several SQLite files.
+
+Models marked with ``__sharded__ = True`` (transactions, budgets and
+subscriptions) are routed to one of ``FINANCE_SHARD_COUNT`` databases chosen
+by a consistent hash of ``user_id``. Everything else (the ``user`` table) stays
+in the default database. With a shard count of 0 sharding is disabled and all
+tables live in the default database, exactly as before.
+"""
+import bisect
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import sqlalchemy as sa
+from flask_sqlalchemy.session import Session
+
+from archive import archived_years, partition_table
+
+
+SHARD_FILE_TEMPLATE = 'finance_shard_{}.db'
+VIRTUAL_NODES = 64
+
+# Bind key of the shard the current thread/request is working against
+_active_shard = ContextVar('active_shard', default=None)
+
+
+def shard_bind_key(index):
+    return f'shard_{index}'
+
+
+def shard_uri(app, index):
+    return 'sqlite:///' + os.path.join(app.instance_path, SHARD_FILE_TEMPLATE.format(index))
+
+
+def configure_shards(app, count):
+    # Must run before SQLAlchemy(app) so the shard engines get created
+    count = int(count or 0)
+    app.config['FINANCE_SHARD_COUNT'] = count
+    binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+    for index in range(count):
+        binds[shard_bind_key(index)] = shard_uri(app, index)
+    app.config['SQLALCHEMY_BINDS'] = binds
+    os.makedirs(app.instance_path, exist_ok=True)
+    return ShardRouter(count)
+
+
+class HashRing:
+    """Consistent hash ring so changing the shard count only moves ~1/N users."""
+
+    def __init__(self, count, virtual_nodes=VIRTUAL_NODES):
+        self.count = count
+        self._points = []
+        self._owners = {}
+        for index in range(count):
+            for replica in range(virtual_nodes):
+                point = self._hash(f'{shard_bind_key(index)}#{replica}')
+                self._owners[point] = index
+                self._points.append(point)
+        self._points.sort()
+
+    @staticmethod
+    def _hash(value):
+        return int(hashlib.md5(str(value).encode('utf-8')).hexdigest()[:16], 16)
+
+    def shard_index(self, user_id):
+        if not self._points:
+            return None
+        position = bisect.bisect(self._points, self._hash(f'user:{user_id}'))
+        return self._owners[self._points[position % len(self._points)]]
+
+
+class ShardRouter:
+    def __init__(self, count):
+        self.count = count
+        self.ring = HashRing(count)
+
+    @property
+    def enabled(self):
+        return self.count > 0
+
+    def bind_keys(self):
+        if not self.enabled:
+            return [None]
+        return [shard_bind_key(index) for index in range(self.count)]
+
+    def shard_for(self, user_id):
+        if not self.enabled or user_id is None:
+            return None
+        return shard_bind_key(self.ring.shard_index(int(user_id)))
+
+    def activate(self, user_id):
+        # Route sharded models for the rest of this request/thread
+        _active_shard.set(self.shard_for(user_id))
+
+    @contextmanager
+    def use_user(self, user_id):
+        with shard_scope(self.shard_for(user_id)):
+            yield
+
+
+@contextmanager
+def shard_scope(bind_key):
+    token = _active_shard.set(bind_key)
+    try:
+        yield
+    finally:
+        _active_shard.reset(token)
+
+
+def is_sharded(mapper):
+    return getattr(mapper.class_, '__sharded__', False)
+
+
+class ShardedSession(Session):
+    """``db.session`` class that sends sharded models to the active shard."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and mapper is not None:
+            bind_key = _active_shard.get()
+            if bind_key is not None and is_sharded(sa.inspect(mapper)):
+                return self._db.engines[bind_key]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def sharded_tables(db):
+    return [mapper.local_table for mapper in db.Model.registry.mappers if is_sharded(mapper)]
+
+
+def create_shard_tables(db, router):
+    if not router.enabled:
+        return
+    tables = sharded_tables(db)
+    for bind_key in router.bind_keys():
+        db.metadata.create_all(bind=db.engines[bind_key], tables=tables)
+
+
+def fan_out(app, router, job, max_workers=None):
+    """Run ``job()`` once per shard in parallel and return the results.
+
+    Each call gets its own app context (and therefore its own session) with the
+    shard already active, so ``Model.query`` inside ``job`` hits that shard.
+    """
+    def run(bind_key):
+        with app.app_context(), shard_scope(bind_key):
+            return job()
+
+    bind_keys = router.bind_keys()
+    if len(bind_keys) == 1:
+        return [run(bind_keys[0])]
+
+    with ThreadPoolExecutor(max_workers=max_workers or len(bind_keys)) as pool:
+        return list(pool.map(run, bind_keys))
+
+
+def rebalance(app, db, router, previous_count=0, batch_size=500):
+    """Move sharded rows to the shard that owns their user under ``router``.
+
+    Scans the default database (rows written before sharding was enabled) and
+    every shard file up to ``max(previous_count, router.count)``, so it handles
+    the initial split, growing/shrinking the shard count and, with a shard count
+    of 0, folding every shard back into the default database. Archived rows in
+    ``<table>_archive_<year>`` partitions move along with their user. Row ids are
+    reassigned on insert since each shard has its own id sequence.
+
+    The app must be stopped while this runs: rows are copied and then deleted,
+    so a write that lands on the old shard in between would be left behind.
+    """
+    tables = sharded_tables(db)
+    targets = {bind_key: db.engines[bind_key] for bind_key in router.bind_keys()}
+    sources = {None: db.engines[None]}
+    sources.update(targets)
+    for index in range(router.count, previous_count):
+        bind_key = shard_bind_key(index)
+        if os.path.exists(os.path.join(app.instance_path, SHARD_FILE_TEMPLATE.format(index))):
+            sources[bind_key] = sa.create_engine(shard_uri(app, index))
+
+    for engine in targets.values():
+        db.metadata.create_all(bind=engine, tables=tables)
+
+    moved = {}
+    for source_key, source_engine in sources.items():
+        inspector = sa.inspect(source_engine)
+        for table in tables:
+            if not inspector.has_table(table.name):
+                continue
+            count = _move_misplaced_rows(source_engine, source_key, table, 'id', targets, router, batch_size)
+            moved[table.name] = moved.get(table.name, 0) + count
+
+            # Archived rows keep their source id; only the partition's own key is reassigned
+            for year in archived_years(source_engine, table):
+                partition = partition_table(table, year)
+                count = _move_misplaced_rows(source_engine, source_key, partition, 'archive_id', targets, router,
+                                             batch_size, create=True)
+                moved[partition.name] = moved.get(partition.name, 0) + count
+
+        if source_key not in targets and source_key is not None:
+            source_engine.dispose()
+
+    return {name: count for name, count in moved.items() if count}
+
+
+def _move_misplaced_rows(source_engine, source_key, table, key, targets, router, batch_size, create=False):
+    # Page through the source by key so a large table never has to fit in memory
+    moved = 0
+    last_key = None
+    while True:
+        query = sa.select(table).order_by(table.c[key]).limit(batch_size)
+        if last_key is not None:
+            query = query.where(table.c[key] > last_key)
+        with source_engine.connect() as source:
+            page = source.execute(query).mappings().all()
+        if not page:
+            return moved
+        last_key = page[-1][key]
+
+        batch = [row for row in page if router.shard_for(row['user_id']) != source_key]
+        if not batch:
+            continue
+
+        by_target = {}
+        for row in batch:
+            values = {name: value for name, value in row.items() if name != key}
+            by_target.setdefault(router.shard_for(row['user_id']), []).append(values)
+
+        # Copy first, then delete, so a crash can only leave duplicates behind
+        for target_key, values in by_target.items():
+            with targets[target_key].begin() as target:
+                if create:
+                    table.create(target, checkfirst=True)
+                target.execute(sa.insert(table), values)
+        with source_engine.begin() as source:
+            source.execute(sa.delete(table).where(table.c[key].in_([row[key] for row in batch])))
+        moved += len(batch)
@@ -0,0 +1,30 @@
+"""Background worker for the job queue.
+
+    python worker.py                  # every lane
+    python worker.py --lanes high     # a worker dedicated to interactive jobs
+
+Run as many of these as needed next to the web server; they share the queue
+in ``instance/jobs.db`` (or ``FINANCE_JOB_DB``).
+"""
+import argparse
+
+from finance_UI import job_queue
+from jobqueue import LANES
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run background jobs for the finance tracker.')
+    parser.add_argument('--lanes', help=f"comma separated lanes to serve ({', '.join(LANES)}); default is all")
+    parser.add_argument('--poll-interval', type=float, default=1.0, help='seconds to sleep when the queue is empty')
+    args = parser.parse_args()
+
+    lanes = args.lanes.split(',') if args.lanes else None
+    for lane in lanes or []:
+        if lane not in LANES:
+            parser.error(f'unknown lane: {lane}')
+
+    job_queue.work(lanes=lanes, poll_interval=args.poll_interval)
+
+
+if __name__ == '__main__':
+    main()